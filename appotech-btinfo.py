@@ -5,11 +5,17 @@
 """appotech-btinfo: manipulate the BTINF sector of AppoTech firmware."""
 
 import argparse
-import hashlib
 import logging
 import sys
+from typing import List, Tuple
 
-from src.common import irange, set_variable, split_in_chunks, write_and_check
+from src.common import (
+    convert_value,
+    irange,
+    map_file,
+    split_in_chunks,
+    write_and_check,
+)
 from src.obj.btinfo import BtInfo
 
 logging.basicConfig(
@@ -17,6 +23,24 @@ logging.basicConfig(
     format="[%(asctime)s] <%(levelname)s> %(message)s",
 )
 
+# Human-readable list of the fields, used in help and error messages
+_BTINFO_FIELDS_STR = ", ".join(BtInfo.CONFIGURABLES)
+
+# Accepted values and lengths of the fields
+_RANGE_U8 = irange(0xFF)
+_RANGE_NAME = irange(32)
+_RANGE_MAC = irange(6, 6)
+
+# Criteria passed to `convert_value` when assigning each of the fields
+_ASSIGN_SPEC = {
+    "flags": {"val_range": _RANGE_U8},
+    "mic_unmute_thresh": {"val_range": _RANGE_U8},
+    "mic_mute_thresh": {"val_range": _RANGE_U8},
+    "mic_mute_duration": {"val_range": _RANGE_U8},
+    "bt_name": {"len_range": _RANGE_NAME},
+    "bt_mac": {"len_range": _RANGE_MAC},
+}
+
 
 class AppotechBtInfo:  # noqa: D101
     PROG_NAME = "appotech-btinfo"
@@ -24,20 +48,30 @@ class AppotechBtInfo:  # noqa: D101
     args: argparse.Namespace
     logger: logging.Logger = logging.getLogger(PROG_NAME)
 
-    input_binary: bytes
+    input_binary: bytes  # a read-only mmap unless the file is empty
     btinfo: BtInfo = BtInfo()
     btinfo_off_start: int  # struct offset in input file
     btinfo_off_end: int  # struct offset in input file
-    btinfo_hash: bytes
+    _dirty: bool = False  # set by the mutators
 
-    def main(self):
-        """Program entry point. Parse args, setup logger, run main logic."""
+    # (field, its value when unset, flag required for the field to be used)
+    _FLAG_CHECKS = (
+        ("bt_name", "", BtInfo.FLAG_CUST_BT_NAME),
+        ("bt_mac", bytes(6), BtInfo.FLAG_CUST_BT_MAC),
+        ("mic_unmute_thresh", 0, BtInfo.FLAG_CUST_MUTE_CFG),
+        ("mic_mute_thresh", 0, BtInfo.FLAG_CUST_MUTE_CFG),
+        ("mic_mute_duration", 0, BtInfo.FLAG_CUST_MUTE_CFG),
+    )
+
+    @classmethod
+    def build_parser(cls) -> argparse.ArgumentParser:
+        """Build the command line parser."""
         # fmt: off
         parser: argparse.ArgumentParser = argparse.ArgumentParser(
-            prog=self.PROG_NAME,
+            prog=cls.PROG_NAME,
             description="Manipulate the BTINF sector of AppoTech firmware",
             epilog=(
-                f"AVAILABLE FIELDS: {', '.join(BtInfo.CONFIGURABLES)}"
+                f"AVAILABLE FIELDS: {_BTINFO_FIELDS_STR}"
             )
         )
         parser.add_argument(
@@ -95,7 +129,11 @@ class AppotechBtInfo:  # noqa: D101
             help="Inject the modified structure into the INFILE contents and save to OUTFILE.",
         )
         # fmt: on
-        self.args = parser.parse_args()
+        return parser
+
+    def main(self):
+        """Program entry point. Parse args, setup logger, run main logic."""
+        self.args = self.build_parser().parse_args()
 
         self.load_input()
         if self.args.print_input:
@@ -118,8 +156,7 @@ class AppotechBtInfo:  # noqa: D101
             self.clear_values()
 
         if self.args.print_output:
-            new_hash = hashlib.sha256(bytes(self.btinfo)).hexdigest()
-            if self.btinfo_hash == new_hash:
+            if not self._dirty:
                 self.logger.info("No modifications were made")
                 sys.exit(0)
             else:
@@ -134,27 +171,25 @@ class AppotechBtInfo:  # noqa: D101
     def load_input(self):
         """Load the input BtInfo structure either from file or use the default one."""
         if self.args.input_path:
-            with open(self.args.input_path, "rb") as fis:
-                self.input_binary = fis.read()
+            self.input_binary = map_file(self.args.input_path)
             self.logger.info(
                 f"Read {len(self.input_binary)} bytes "
                 f"from {self.args.input_path}"
             )
 
-            # Don't you hate mixing EAFP...
-            try:
-                self.btinfo_off_start = self.input_binary.index(BtInfo.MAGIC)
-            except ValueError:
-                self.logger.exception("Could not find magic value in file")
+            self.btinfo_off_start = self.input_binary.find(BtInfo.MAGIC)
+            if self.btinfo_off_start == -1:
+                self.logger.error("Could not find magic value in file")
                 sys.exit(1)
-            # ... and LBYL, do you?
             self.btinfo_off_end = self.btinfo_off_start + BtInfo.SIZE
             if self.btinfo_off_end > len(self.input_binary):
                 self.logger.error("Truncated data!")
                 sys.exit(1)
 
             self.btinfo.load(
-                self.input_binary[self.btinfo_off_start : self.btinfo_off_end]
+                memoryview(self.input_binary)[
+                    self.btinfo_off_start : self.btinfo_off_end
+                ]
             )
         else:
             self.logger.info(
@@ -162,7 +197,6 @@ class AppotechBtInfo:  # noqa: D101
             )
             self.btinfo_off_start = 0
             self.btinfo_off_end = BtInfo.SIZE
-        self.btinfo_hash = hashlib.sha256(bytes(self.btinfo)).hexdigest()
 
     def print_values(self):
         """Pretty-print all available fields in the structure."""
@@ -170,23 +204,25 @@ class AppotechBtInfo:  # noqa: D101
         self.check_flags()
         print(str(self.btinfo))
 
-    # fmt: off
-    def check_flags(self):  # noqa: E501
+    def check_flags(self):
         """Check if the flags are set to enable usage of corresponding fields."""
         bt: BtInfo = self.btinfo
         flags: int = bt.flags
-        
-        if bt.bt_name and not (flags & BtInfo.FLAG_CUST_BT_NAME):
-            self.logger.warning("bt_name is set but won't be used! flag not set")
-        if bt.bt_mac != (b"\x00" * 6) and not (flags & BtInfo.FLAG_CUST_BT_MAC):
-            self.logger.warning("bt_mac is set but won't be used! flag not set")
-        if bt.mic_unmute_thresh and not (flags & BtInfo.FLAG_CUST_MUTE_CFG):
-            self.logger.warning("mic_unmute_thresh is set but won't be used! flag not set")
-        if bt.mic_mute_thresh and not (flags & BtInfo.FLAG_CUST_MUTE_CFG):
-            self.logger.warning("mic_mute_thresh is set but won't be used! flag not set")
-        if bt.mic_mute_duration and not (flags & BtInfo.FLAG_CUST_MUTE_CFG):
-            self.logger.warning("mic_mute_duration is set but won't be used! flag not set")
-    # fmt: on
+
+        for field, unset_value, flag in self._FLAG_CHECKS:
+            if getattr(bt, field) != unset_value and not (flags & flag):
+                self.logger.warning(
+                    "%s is set but won't be used! flag not set", field
+                )
+
+    def check_field(self, field: str):
+        """Exit if the structure has no configurable field named `field`."""
+        if field not in _ASSIGN_SPEC:
+            self.logger.error(
+                f"Unknown field {field}. "
+                f"Available fields: {_BTINFO_FIELDS_STR}"
+            )
+            sys.exit(1)
 
     def assign_values(self):
         """Assign structure fields based on key-value pairs from CLI args."""
@@ -194,42 +230,50 @@ class AppotechBtInfo:  # noqa: D101
             self.logger.error("Invalid pairs specified for -S swtich")
             sys.exit(1)
 
-        # Iterate through the pairs: (key, value)
+        # Iterate through the pairs: (key, value). Validate all the fields and
+        # values before modifying anything.
+        ops: List[Tuple[str, str, object]] = []
         for field, value in split_in_chunks(self.args.assign_values, 2):
-            if field in (
-                "flags",
-                "mic_unmute_thresh",
-                "mic_mute_thresh",
-                "mic_mute_duration",
-            ):
-                set_variable(self.btinfo, field, value, val_range=irange(0xFF))
-            elif field == "bt_name":
-                set_variable(self.btinfo, field, value, len_range=irange(32))
-            elif field == "bt_mac":
-                set_variable(self.btinfo, field, value, len_range=irange(6, 6))
-            else:
-                self.logger.error(
-                    f"Unknown field {field}. "
-                    f"Available fields: {', '.join(BtInfo.CONFIGURABLES)}"
-                )
-                sys.exit(1)
-            self.logger.info(f"Successfully assigned btinfo.{field} = {value}")
+            self.check_field(field)
+            new_value = convert_value(
+                self.btinfo, field, value, **_ASSIGN_SPEC[field]
+            )
+            ops.append((field, value, new_value))
+
+        for field, value, new_value in ops:
+            setattr(self.btinfo, field, new_value)
+            self.logger.info(
+                "Successfully assigned btinfo.%s = %s", field, value
+            )
+        self._dirty = True
 
     def clear_values(self):
         """Clear structure fields based on keys (variable names) from CLI args."""
         # create dummy object with default values set
         dummy: BtInfo = BtInfo()
 
+        # Validate all the fields before modifying anything
+        for field in self.args.clear_values:
+            self.check_field(field)
+
         for field in self.args.clear_values:
-            if field not in BtInfo.CONFIGURABLES:
-                self.logger.error(
-                    f"Unknown field {field}. "
-                    f"Available fields: {', '.join(BtInfo.CONFIGURABLES)}"
-                )
-                sys.exit(1)
             value = getattr(dummy, field)
             setattr(self.btinfo, field, value)
-            self.logger.info(f"Successfully assigned btinfo.{field} = {value}")
+            self.logger.info(
+                "Successfully assigned btinfo.%s = %s", field, value
+            )
+        self._dirty = True
+
+    def build_injected(self, blob: bytes) -> Tuple[bytes, bytes, bytes]:
+        """Return the parts of the modified source file in order:
+        (data before the struct), (struct), (data after the struct)."""
+        # Views of the unchanged parts, they are streamed to disk as is
+        src: memoryview = memoryview(self.input_binary)
+        return (
+            src[: self.btinfo_off_start],
+            blob,
+            src[self.btinfo_off_end :],
+        )
 
     def save_output(self):
         """Save the structure as standalone file and/or modified source file."""
@@ -238,19 +282,15 @@ class AppotechBtInfo:  # noqa: D101
         # Check flags and alert user just in case
         self.check_flags()
 
-        for path in (self.args.output_path, self.args.mod_path):
-            if not path:
-                continue
-            if path == self.args.output_path:
-                self.logger.info("Saving just the struct")
-            elif path == self.args.mod_path:
-                self.logger.info("Injecting modified struct into source file")
-                blob = bytes(
-                    self.input_binary[: self.btinfo_off_start]
-                    + blob
-                    + self.input_binary[self.btinfo_off_end :]
-                )
-            if not write_and_check(path, blob):
+        if self.args.output_path:
+            self.logger.info("Saving just the struct")
+            if not write_and_check(self.args.output_path, blob):
+                sys.exit(1)
+        if self.args.mod_path:
+            self.logger.info("Injecting modified struct into source file")
+            if not write_and_check(
+                self.args.mod_path, *self.build_injected(blob)
+            ):
                 sys.exit(1)
 
 
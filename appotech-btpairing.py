@@ -5,15 +5,16 @@
 """appotech-btpairing: Manipulate the DB_RECORD (BTPAIRINFO) sector of AppoTech firmware."""
 
 import argparse
-import hashlib
 import logging
 import sys
-from typing import List
+from collections import Counter
+from typing import List, Tuple
 
 from src.common import (
+    convert_value,
     indices_atoi_list,
     irange,
-    set_variable,
+    map_file,
     split_in_chunks,
     write_and_check,
 )
@@ -24,6 +25,23 @@ logging.basicConfig(
     format="[%(asctime)s] <%(levelname)s> %(message)s",
 )
 
+# Human-readable list of the entry fields, used in help and error messages
+_BTPAIRING_FIELDS_STR = ", ".join(BtPairing.Entry.CONFIGURABLES)
+
+# Accepted values and lengths of the fields
+_RANGE_U8 = irange(0xFF)
+_RANGE_LINK_KEY = irange(16)
+_RANGE_MAC = irange(6)
+_RANGE_NAME = irange(32)
+
+# Criteria passed to `convert_value` when assigning each of the entry fields
+_ASSIGN_SPEC = {
+    "link_key": {"len_range": _RANGE_LINK_KEY},
+    "bt_mac": {"len_range": _RANGE_MAC},
+    "bt_name": {"len_range": _RANGE_NAME},
+    "is_valid": {},
+}
+
 
 class AppotechBtPairing:  # noqa: D101
     PROG_NAME = "appotech-btpairing"
@@ -31,20 +49,21 @@ class AppotechBtPairing:  # noqa: D101
     args: argparse.Namespace
     logger: logging.Logger = logging.getLogger(PROG_NAME)
 
-    input_binary: bytes
+    input_binary: bytes  # a read-only mmap unless the file is empty
     bp: BtPairing = BtPairing()
     bp_off_start: int  # struct offset in input file
     bp_size: int  # struct size right after it's been loaded from file
-    bp_hash: bytes
+    _dirty: bool = False  # set by the mutators
 
-    def main(self):
-        """Program entry point. Parse args, setup logger, run main logic."""
+    @classmethod
+    def build_parser(cls) -> argparse.ArgumentParser:
+        """Build the command line parser."""
         # fmt: off
         parser: argparse.ArgumentParser = argparse.ArgumentParser(
-            prog=self.PROG_NAME,
+            prog=cls.PROG_NAME,
             description="Manipulate the DB_RECORD (BTPAIRINFO) sector of AppoTech firmware",
             epilog=(
-                f"AVAILABLE ENTRY FIELDS: {', '.join(BtPairing.Entry.CONFIGURABLES)}"
+                f"AVAILABLE ENTRY FIELDS: {_BTPAIRING_FIELDS_STR}"
             )
         )
         parser.add_argument(
@@ -70,14 +89,21 @@ class AppotechBtPairing:  # noqa: D101
             dest="add_entries",
             metavar="i",
             nargs="+",
-            help="Add an empty entry at index. Indices are processed sequentially."
+            help=(
+                "Add an empty entry at index. "
+                "Indices are processed sequentially. "
+                "Negative indices count from the last entry."
+            )
         )
         parser.add_argument(
             "-d",
             dest="delete_entries",
             metavar="i",
             nargs="+",
-            help="Delete entry at index. Indices are accepted in any order."
+            help=(
+                "Delete entry at index. Indices are accepted in any order. "
+                "Negative indices count from the last entry."
+            )
         )
         parser.add_argument(
             "-S",
@@ -87,6 +113,7 @@ class AppotechBtPairing:  # noqa: D101
             help=(
                 "Set (assign) values to the fields of entry by its index. "
                 "Example: -S 0 bt_name \"amogus\". "
+                "Negative indices count from the last entry. "
                 "See AVAILABLE ENTRY FIELDS below."
             ),
         )
@@ -98,6 +125,7 @@ class AppotechBtPairing:  # noqa: D101
             help=(
                 "Clear values in the fields of entry by its index. "
                 "Example: -C 3 link_key. "
+                "Negative indices count from the last entry. "
                 "See AVAILABLE ENTRY FIELDS below."
             )
         )
@@ -135,7 +163,11 @@ class AppotechBtPairing:  # noqa: D101
             )
         )
         # fmt: on
-        self.args = parser.parse_args()
+        return parser
+
+    def main(self):
+        """Program entry point. Parse args, setup logger, run main logic."""
+        self.args = self.build_parser().parse_args()
 
         self.load_input()
         if self.args.print_input:
@@ -167,8 +199,7 @@ class AppotechBtPairing:  # noqa: D101
             self.set_paired_index()
 
         if self.args.print_output:
-            new_hash = hashlib.sha256(bytes(self.bp)).hexdigest()
-            if self.bp_hash == new_hash:
+            if not self._dirty:
                 self.logger.info("No modifications were made")
                 sys.exit(0)
             else:
@@ -183,28 +214,26 @@ class AppotechBtPairing:  # noqa: D101
     def load_input(self):
         """Load the input BtPairing structure either from file or use the default one."""
         if self.args.input_path:
-            with open(self.args.input_path, "rb") as fis:
-                self.input_binary = fis.read()
+            self.input_binary = map_file(self.args.input_path)
             self.logger.info(
                 f"Read {len(self.input_binary)} bytes "
                 f"from {self.args.input_path}"
             )
 
-            try:  # EAFP :(
-                self.bp_off_start = self.input_binary.index(BtPairing.MAGIC)
-            except ValueError:
-                self.logger.exception("Could not find magic value in file")
+            self.bp_off_start = self.input_binary.find(BtPairing.MAGIC)
+            if self.bp_off_start == -1:
+                self.logger.error("Could not find magic value in file")
                 sys.exit(1)
 
             # Read the rest of the file because it's troublesome to determine
-            # the size of the structure without decoding it first.
-            self.bp.load(self.input_binary[self.bp_off_start :])
+            # the size of the structure without decoding it first. Use a view
+            # to avoid copying the whole tail of the image.
+            self.bp.load(memoryview(self.input_binary)[self.bp_off_start :])
         else:
             self.logger.info(
                 "Input file was not provided, using empty structure"
             )
             self.bp_off_start = 0
-        self.bp_hash = hashlib.sha256(bytes(self.bp)).hexdigest()
         self.bp_size = self.bp.length()
 
     def print_values(self):
@@ -214,31 +243,65 @@ class AppotechBtPairing:  # noqa: D101
 
     def add_entries(self):
         """Inject new empty entries at the indices from CLI args"""
+        count: int = len(self.bp.entries)
         idx: List[int] = indices_atoi_list(
-            self.args.add_entries, len(self.bp.entries)
+            self.args.add_entries, count, -count
         )
         if not idx:  # the error has already been logged by the function above
             sys.exit(1)
 
-        for i in idx:
-            self.logger.info(f"Injecting empty entry at index {i}")
-            self.bp.entries.insert(i, BtPairing.Entry())
+        # Rebuild the list in one pass instead of shifting its tail on every
+        # insert. The same index may be given several times. Negative indices
+        # count from the end, like in `list.insert`.
+        counts: Counter = Counter(i + count if i < 0 else i for i in idx)
+        entries: List[BtPairing.Entry] = []
+        for i in irange(count):
+            for _ in range(counts[i]):
+                self.logger.info(f"Injecting empty entry at index {i}")
+                entries.append(BtPairing.Entry())
+            if i < len(self.bp.entries):
+                entries.append(self.bp.entries[i])
+        self.bp.entries = entries
+        self._dirty = True
 
     def delete_entries(self):
         """Delete entries at the indices from CLI args"""
+        count: int = len(self.bp.entries)
         idx: List[int] = indices_atoi_list(
-            self.args.delete_entries, len(self.bp.entries)
+            self.args.delete_entries, count - 1, -count
         )
         if not idx:  # the error has already been logged by the function above
             sys.exit(1)
 
-        self.bp.entries = [
-            self.bp.entries[i]
-            for i in range(len(self.bp.entries))
-            if i not in idx
-        ]
-        for i in idx:
+        # Negative indices count from the end, like in `parse_index`. Map
+        # them to the positive ones so both forms of an index are deduped.
+        # Delete in place starting from the end of the list so the indices
+        # still to be processed are not shifted. Skip duplicate indices.
+        for i in sorted({i % count for i in idx}, reverse=True):
+            del self.bp.entries[i]
             self.logger.info(f"Removed entry at index {i}")
+        self._dirty = True
+
+    def parse_index(self, index: str) -> int:
+        """Convert `index` to int or exit if there's no entry with it.
+        Negative indices count from the end, like in Python."""
+        count: int = len(self.bp.entries)
+        if not index.lstrip("-").isdecimal() or not (
+            -count <= int(index) < count
+        ):
+            self.logger.error(f"Invalid index {index}")
+            sys.exit(1)
+        return int(index)
+
+    def check_field(self, field: str) -> str:
+        """Return `field` or exit if the entry has no such configurable."""
+        if field not in _ASSIGN_SPEC:
+            self.logger.error(
+                f"Unknown field {field}. "
+                f"Available fields: {_BTPAIRING_FIELDS_STR}"
+            )
+            sys.exit(1)
+        return field
 
     def assign_values(self):
         """Assign entry fields based on index-key-value triplets from CLI args."""
@@ -246,70 +309,57 @@ class AppotechBtPairing:  # noqa: D101
             self.logger.error("Invalid values specified for -S swtich")
             sys.exit(1)
 
-        # Iterate through the pairs: (key, value)
+        # Validate all the triplets, values included, before modifying anything
+        ops: List[Tuple[int, str, str, object]] = []
         for index, field, value in split_in_chunks(self.args.assign_values, 3):
-            idx: int = 0
-            try:
-                idx = int(index)
-                if idx > len(self.bp.entries):
-                    raise ValueError()
-            except ValueError:
-                self.logger.exception(f"Invalid index {idx}")
-                sys.exit(1)
-            entry: BtPairing.Entry = self.bp.entries[idx]
-
-            if field == "link_key":
-                set_variable(entry, field, value, len_range=irange(16))
-            elif field == "bt_mac":
-                set_variable(entry, field, value, len_range=irange(6))
-            elif field == "bt_name":
-                set_variable(entry, field, value, len_range=irange(32))
-            elif field == "is_valid":
-                set_variable(entry, field, value)
-            else:
-                self.logger.error(
-                    f"Unknown field {field}. "
-                    f"Available fields: {', '.join(BtPairing.Entry.CONFIGURABLES)}"
-                )
-                sys.exit(1)
+            idx: int = self.parse_index(index)
+            self.check_field(field)
+            new_value = convert_value(
+                self.bp.entries[idx], field, value, **_ASSIGN_SPEC[field]
+            )
+            ops.append((idx, field, value, new_value))
+
+        for idx, field, value, new_value in ops:
+            setattr(self.bp.entries[idx], field, new_value)
             self.logger.info(
-                f"Successfully assigned bp.entries[{idx}].{field} = {value}"
+                "Successfully assigned bp.entries[%d].%s = %s",
+                idx,
+                field,
+                value,
             )
+        self._dirty = True
 
     def clear_values(self):
         """Clear entry fields based on index-key pairs from CLI args."""
         # create dummy object with default values set
         dummy: BtPairing.Entry = BtPairing.Entry()
 
+        if len(self.args.clear_values) % 2 != 0:
+            self.logger.error("Invalid pairs specified for -C switch")
+            sys.exit(1)
+
+        # Validate all the pairs before modifying anything
+        ops: List[Tuple[int, str]] = []
         for index, field in split_in_chunks(self.args.clear_values, 2):
-            idx: int = 0
-            try:
-                idx = int(index)
-                if idx > len(self.bp.entries):
-                    raise ValueError()
-            except ValueError:
-                self.logger.error(f"Invalid index {idx}")
-                sys.exit(1)
-            entry: BtPairing.Entry = self.bp.entries[idx]
+            ops.append((self.parse_index(index), self.check_field(field)))
 
-            if field not in BtPairing.Entry.CONFIGURABLES:
-                self.logger.error(
-                    f"Unknown field {field}. "
-                    f"Available fields: {', '.join(BtPairing.Entry.CONFIGURABLES)}"
-                )
-                sys.exit(1)
+        for idx, field in ops:
             value = getattr(dummy, field)
-            setattr(entry, field, value)
+            setattr(self.bp.entries[idx], field, value)
             self.logger.info(
-                f"Successfully assigned bp.entries[{idx}].{field} = {value}"
+                "Successfully assigned bp.entries[%d].%s = %s",
+                idx,
+                field,
+                value,
             )
+        self._dirty = True
 
     def set_paired_index(self):
         """Set index of the latest connected device"""
         idx: int = 0
         try:
             idx = int(self.args.paired_idx)
-            if idx not in irange(0xFF):
+            if idx not in _RANGE_U8:
                 raise ValueError()
         except ValueError:
             self.logger.error(f"Invalid index {idx}")
@@ -317,54 +367,61 @@ class AppotechBtPairing:  # noqa: D101
 
         self.bp.paired_idx = idx
         self.logger.info(f"Successfully assigned bp.paired_idx = {idx}")
+        self._dirty = True
+
+    def build_injected(self, blob: bytes) -> Tuple[bytes, bytes, bytes]:
+        """Fit the serialized structure into its original region of the
+        source file. Return the parts of the modified source file in order:
+        (data before the struct), (struct), (data after the struct)."""
+        if len(blob) > self.bp_size:
+            if self.args.force_write_mod:
+                delta: int = (
+                    self.bp_off_start + len(blob) - len(self.input_binary)
+                )
+                if delta > 0:
+                    self.logger.warning(
+                        f"File size limit exceeded by {delta} bytes. "
+                        "Truncating (yes, happens even with `-f`)."
+                    )
+                    blob = blob[: len(blob) - delta]
+            else:
+                self.logger.error(
+                    "Modified blob is bigger than original! "
+                    f"{len(blob)} vs {self.bp_size}. Refusing to write "
+                    "because it overlaps its own region. Consider "
+                    "using the `-f` option."
+                )
+                sys.exit(1)
+        elif len(blob) < self.bp_size:
+            padding_sz: int = self.bp_size - len(blob)
+            self.logger.warning(
+                "Modified blob is smaller than original! "
+                f"{len(blob)} vs {self.bp_size}. "
+                f"Added {padding_sz} bytes of padding."
+            )
+            blob = blob.ljust(self.bp_size, b"\xFF")
+
+        # Views of the unchanged parts, they are streamed to disk as is
+        src: memoryview = memoryview(self.input_binary)
+        return (
+            src[: self.bp_off_start],
+            blob,
+            src[self.bp_off_start + len(blob) :],
+        )
 
     def save_output(self):
         """Save the structure as standalone file and/or modified source file."""
         blob: bytes = bytes(self.bp)
 
-        for path in (self.args.output_path, self.args.mod_path):
-            if not path:
-                continue
-            if path == self.args.output_path:
-                self.logger.info("Saving just the struct")
-            elif path == self.args.mod_path:
-                self.logger.info("Injecting modified struct into source file")
-                # assemble the modified binary
-                if len(blob) > self.bp_size:
-                    if self.args.force_write_mod:
-                        delta: int = (
-                            self.bp_off_start
-                            + len(blob)
-                            - len(self.input_binary)
-                        )
-                        if delta > 0:
-                            self.logger.warning(
-                                f"File size limit exceeded by {delta} bytes. "
-                                "Truncating (yes, happens even with `-f`)."
-                            )
-                            blob = blob[: len(blob) - delta]
-                    else:
-                        self.logger.error(
-                            "Modified blob is bigger than original! "
-                            f"{len(blob)} vs {self.bp_size}. Refusing to write "
-                            "because it overlaps its own region. Consider "
-                            "using the `-f` option."
-                        )
-                        sys.exit(1)
-                elif len(blob) < self.bp_size:
-                    padding_sz = len(blob) - self.bp_size
-                    blob = blob + (b"\xFF" * padding_sz)
-                    self.logger.warning(
-                        "Modified blob is bigger than original! "
-                        f"{len(blob)} vs {self.bp_size}. "
-                        f"Added {padding_sz} bytes of padding."
-                    )
-                blob = bytes(
-                    self.input_binary[: self.bp_off_start]
-                    + blob
-                    + self.input_binary[self.bp_off_start + len(blob) :]
-                )
-            if not write_and_check(path, blob):
+        if self.args.output_path:
+            self.logger.info("Saving just the struct")
+            if not write_and_check(self.args.output_path, blob):
+                sys.exit(1)
+        if self.args.mod_path:
+            self.logger.info("Injecting modified struct into source file")
+            if not write_and_check(
+                self.args.mod_path, *self.build_injected(blob)
+            ):
                 sys.exit(1)
 
 
@@ -12,7 +12,12 @@ import sys
 from datetime import datetime
 from typing import List
 
-from src.common import align_bytes, find_all, write_and_check
+from src.common import (
+    align_bytes,
+    find_all_aligned,
+    map_file,
+    write_and_check,
+)
 from src.obj.sfx import SfxBlob
 
 logging.basicConfig(
@@ -20,6 +25,13 @@ logging.basicConfig(
     format="[%(asctime)s] <%(levelname)s> %(message)s",
 )
 
+# Alignment of the SFX blob within the firmware image
+_SFX_ALIGN = 0x80
+# Most non-zero bytes a valid SFX blob header can have: zeroes must take more
+# than 80% of it. The header is checked in segments of the given size.
+_SFX_HDR_MAX_NONZERO = SfxBlob.HDR_SIZE - int(SfxBlob.HDR_SIZE * 0.8) - 1
+_SFX_HDR_SEG_SIZE = 0x100
+
 
 class AppotechSfx:  # noqa: D101
     PROG_NAME = "appotech-sfx"
@@ -27,18 +39,19 @@ class AppotechSfx:  # noqa: D101
     args: argparse.Namespace
     logger: logging.Logger = logging.getLogger(PROG_NAME)
 
-    input_binary: bytes
+    input_binary: bytes  # a read-only mmap unless the file is empty
     input_files: List[str]
 
     sb: SfxBlob = SfxBlob()
     sb_off_start: int
     sb_size: int
 
-    def main(self):
-        """Program entry point. Parse args, setup logger, run main logic."""
+    @classmethod
+    def build_parser(cls) -> argparse.ArgumentParser:
+        """Build the command line parser."""
         # fmt: off
         parser: argparse.ArgumentParser = argparse.ArgumentParser(
-            prog=self.PROG_NAME,
+            prog=cls.PROG_NAME,
             description="""Manipulate the SFX blob of AppoTech firmware.
 The program has 2 modes of operation depending on the type of INPUT. If it's
 a file, it's treated as a firmware image (or a standalone SFX blob) and EXTRACT
@@ -124,7 +137,11 @@ some space."""
             )
         )
         # fmt: on
-        self.args = parser.parse_args()
+        return parser
+
+    def main(self):
+        """Program entry point. Parse args, setup logger, run main logic."""
+        self.args = self.build_parser().parse_args()
 
         if io.isfile(self.args.input_path):
             self.mode_extract()
@@ -146,8 +163,7 @@ some space."""
 
     def extract_load_input(self):
         """Load the input SFX blob from file."""
-        with open(self.args.input_path, "rb") as fis:
-            self.input_binary = fis.read()
+        self.input_binary = map_file(self.args.input_path)
 
         """Search for the "00080000" hexadecimal sequence. Explanation:
         in SfxBlob, entries follow after the header. The header has a fixed
@@ -159,24 +175,15 @@ some space."""
         multiple such values in the dumped firmware image, so we must also
         match the correct one."""
         self.sb_off_start = -1
-        for test_off in find_all(
-            self.input_binary[: -SfxBlob.HDR_SIZE], SfxBlob.MAGIC
+        # The whole header must fit in the file. Bound the search instead of
+        # slicing the input, which would copy almost all of it.
+        search_end: int = max(len(self.input_binary) - SfxBlob.HDR_SIZE, 0)
+        # The SFX blob seems to be always aligned by 0x80 (128 bytes), so
+        # only the aligned matches are considered.
+        for test_off in find_all_aligned(
+            self.input_binary, SfxBlob.MAGIC, _SFX_ALIGN, search_end
         ):
-            # The SFX blob seems to be always aligned by 0x80 (128 bytes)
-            if test_off % 0x80 != 0:
-                self.logger.info(
-                    f"Found header at {test_off} but it's not an SFX blob "
-                    "(not aligned), keep searching"
-                )
-                continue
-            """The header is quite big, and usually it's not filled to the brim.
-            Count zeroes in the header. Assume the header valid if zeroes take
-            take more than 80% of space. This is a probabilistic approach but
-            it hasn't caused any Type II errors (yet)."""
-            zeroes = self.input_binary[
-                test_off : test_off + SfxBlob.HDR_SIZE
-            ].count(0x00)
-            if zeroes <= SfxBlob.HDR_SIZE * 0.8:
+            if not self.is_mostly_zero(test_off):
                 self.logger.info(
                     f"Found header at {test_off} but it's not an SFX blob "
                     "(weird amount of zeroes), keep searching"
@@ -192,9 +199,28 @@ some space."""
 
         # Read the rest of the file because it's troublesome to determine
         # the size of the structure without decoding it first.
-        self.sb.load(self.input_binary[self.sb_off_start :])
+        # Pass a view, slicing the input would copy the rest of the file.
+        self.sb.load(memoryview(self.input_binary)[self.sb_off_start :])
         self.sb_size = self.sb.total_size_in_bytes()
 
+    def is_mostly_zero(self, off: int) -> bool:
+        """Return True if zeroes take more than 80% of the header at `off`.
+
+        The header is quite big, and usually it's not filled to the brim, so
+        a valid one is mostly zeroes. This is a probabilistic approach but
+        it hasn't caused any Type II errors (yet).
+        The header is counted piece by piece so that a candidate full of data
+        is rejected as soon as it has too many non-zero bytes."""
+        nonzero: int = 0
+        for seg_off in range(off, off + SfxBlob.HDR_SIZE, _SFX_HDR_SEG_SIZE):
+            segment: bytes = self.input_binary[
+                seg_off : seg_off + _SFX_HDR_SEG_SIZE
+            ]
+            nonzero += len(segment) - segment.count(0x00)
+            if nonzero > _SFX_HDR_MAX_NONZERO:
+                return False
+        return True
+
     def extract_print_input(self):
         """Print SFX blob info. This function can't be moved into sfx.py's
         __str__ because it depends on local variables `self.sb_off_start` and
@@ -204,31 +230,32 @@ some space."""
         offset_end: int = 0
         sep: str = "------------------------------\n"
 
-        contents: str = (
+        # Collect the parts and join them once at the end
+        contents: List[str] = [
             "SFX BLOB SUMMARY\n"
             f"{'Offset: ':<15}{self.sb_off_start}-{self.sb_off_start + self.sb_size}\n"
             f"{'Entries: ':<15}{len(self.sb.entries)}\n"
             f"{'Size: ':<15}{self.sb_size} bytes\n"
             f"{sep}"
-        )
+        ]
 
         for idx, entry in enumerate(self.sb.entries):
             offset_start = self.sb_off_start + entry.offset
             offset_end = offset_start + entry.total_size_in_bytes()
-            contents += (
+            contents.append(
                 f"Entry #{idx}\n"
                 f"{'Offset: ':<15}{offset_start}-{offset_end} (relative to file)\n"
                 f"{entry}\n"
                 f"{sep}"
             )
-        print(contents.strip())
+        print("".join(contents).strip())
 
     def extract_carve(self):
         """Save the extracted SFX blob as standalone file."""
         self.logger.info("Carving out the SFX blob")
         if not write_and_check(
             self.args.carve_output_path,
-            self.input_binary[
+            memoryview(self.input_binary)[
                 self.sb_off_start : self.sb_off_start + self.sb_size
             ],
         ):
@@ -267,17 +294,17 @@ some space."""
     def repack_load_input(self):
         """Load the input files from the specified directory and build the
         SFX blob out of them."""
-        # First, list all files in the specified directory
-        self.input_files = [
-            io.join(self.args.input_path, f)
-            for f in os.listdir(self.args.input_path)
-        ]
-        # Keep only MP3 and WAV (basic file extension check)
-        self.input_files = [
-            f for f in self.input_files if f.lower().endswith((".mp3", ".wav"))
-        ]
-        # Sort by file name
-        self.input_files = sorted(self.input_files, key=str.lower)
+        # List the files in the specified directory, keep only MP3 and WAV
+        # (basic file extension check) and sort them by name in one pass
+        with os.scandir(self.args.input_path) as it:
+            self.input_files = sorted(
+                (
+                    entry.path
+                    for entry in it
+                    if entry.name.lower().endswith((".mp3", ".wav"))
+                ),
+                key=str.lower,
+            )
 
         if len(self.input_files) > SfxBlob.MAX_ENTRIES:
             self.logger.error("Too many files for a SFX blob!")
@@ -288,8 +315,8 @@ some space."""
 
     def repack_save_output(self):
         """Save the built SFX blob as standalone file."""
-        self.logger.info(f"Creating SFX blob {self.args.output_file}")
-        if not write_and_check(self.args.output_file, bytes(self.sb)):
+        self.logger.info(f"Creating SFX blob {self.args.output_path}")
+        if not write_and_check(self.args.output_path, self.sb.to_bytearray()):
             sys.exit(1)
 
     def repack_inject_output(self):
@@ -298,7 +325,7 @@ some space."""
         self.logger.info(f"Injecting the SFX blob into {self.args.inject_path}")
 
         # Right now `self.sb` holds the SFX blob built from `self.args.input_file`
-        blob = bytes(self.sb)
+        blob = self.sb.to_bytearray()
 
         # Use `extract_load_input` to load the source file into `self.sb`, this
         # will also refresh `self.sb_off_start` and `self.sb_size`.
@@ -331,15 +358,18 @@ some space."""
                     "using the `-f` option."
                 )
                 sys.exit(1)
-        blob = bytes(
-            self.input_binary[: self.sb_off_start]
-            + blob
-            + self.input_binary[self.sb_off_start + len(blob) :]
-        )
 
         timestamp: str = datetime.now().strftime("%Y%m%d_%H%M%S")
         path: str = f"{self.args.inject_path}-{timestamp}-mod.bin"
-        if not write_and_check(path, blob):
+        # Stream the unchanged parts of the source file around the blob
+        # straight from the mapping instead of concatenating everything.
+        src: memoryview = memoryview(self.input_binary)
+        if not write_and_check(
+            path,
+            src[: self.sb_off_start],
+            blob,
+            src[self.sb_off_start + len(blob) :],
+        ):
             sys.exit(1)
 
 
@@ -3,12 +3,20 @@
 
 """Common utility functions."""
 
+import functools
 import logging
-import math
-from typing import List, get_type_hints
+import mmap
+import os
+import stat
+from typing import List, Optional, Union, get_type_hints
 
 from src.error import AppotechError
 
+# Single-byte `bytes` objects for every value, used as padding fillers
+_ONE_BYTE = tuple(bytes((i,)) for i in range(256))
+# Largest amount of data passed to a single `write` syscall
+_WRITE_MAX = 16 << 20
+
 
 def irange(a, b=None, c=1):
     """Inclusive range"""
@@ -33,15 +41,35 @@ def find_all(where, what):
         yield pos
 
 
+def find_all_aligned(where, what, align: int, end: Optional[int] = None):
+    """Yield positions of the occurrences of the specified pattern that start
+    at a multiple of `align`. After a misaligned match the search resumes at
+    the next boundary, skipping the bytes no aligned match can start at.
+    If `end` is given, only the occurrences fitting entirely before it are
+    reported. This is the same as searching `where[:end]` but doesn't copy
+    the data."""
+    if end is None:
+        end = len(where)
+    pos = 0
+    while True:
+        pos = where.find(what, pos, end)
+        if pos == -1:
+            break
+        if pos % align:
+            pos += align - pos % align
+            continue
+        yield pos
+        pos += align
+
+
 def as_hex(obj, size: int = 4) -> str:
     """Represent an object as hex string"""
     if isinstance(obj, list) or isinstance(obj, tuple):
         return ", ".join(as_hex(i) for i in obj)
-    elif isinstance(obj, bytes) or isinstance(obj, bytearray):
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
         return obj.hex().upper()
     elif isinstance(obj, int):
-        fmt = "{:0" + str(size * 2) + "X}"
-        return fmt.format(obj)
+        return format(obj, f"0{size * 2}X")
     else:
         return "?" * (size * 2)
 
@@ -63,16 +91,20 @@ def align_bytes(src: bytes, align_to: int, pad: int = 0x00) -> bytes:
         bytes: The aligned bytes.
     """
     src_sz: int = len(src)
-    new_sz: int = math.ceil(src_sz / align_to) * align_to
+    # Integer ceiling, no round trip through float
+    new_sz: int = -(-src_sz // align_to) * align_to
 
     if src_sz == new_sz:
         return src
-    return src.ljust(new_sz, (pad & 0xFF).to_bytes(1, byteorder="little"))
+    return src.ljust(new_sz, _ONE_BYTE[pad & 0xFF])
 
 
-def indices_atoi_list(src: List[str], max_val: int) -> List[int]:
+def indices_atoi_list(
+    src: List[str], max_val: int, min_val: int = 0
+) -> List[int]:
     """Convert a list of strings to list of integers sorted in reverse order.
-    Return `None` if any value is invalid OR is greater than `max`"""
+    Return `None` if any value is invalid OR is greater than `max_val` OR is
+    less than `min_val`"""
     result: List[int] = []
     i: int = 0
     for s in src:
@@ -84,12 +116,87 @@ def indices_atoi_list(src: List[str], max_val: int) -> List[int]:
         if i > max_val:
             logging.error(f"Index is too big, {i} > {max_val}")
             return None
+        if i < min_val:
+            logging.error(f"Invalid index {i}, it's less than {min_val}")
+            return None
         result.append(i)
     result.sort(reverse=True)
     return result
 
 
-def set_variable(
+@functools.lru_cache(maxsize=None)
+def _type_hints(cls: type) -> dict:
+    """Return the type hints of `cls`. Classes don't change their annotations
+    at runtime, so the result is cached instead of being resolved each time."""
+    return get_type_hints(cls)
+
+
+def _convert_int(var_name, var_value, var_type, val_range, len_range):
+    try:
+        value: int = int(var_value)
+    except ValueError as ex:
+        raise AppotechError(
+            f"Cannot assign {var_name} to \"{var_value}\" because "
+            f"it's not an integer"
+        ) from ex  # fmt: skip
+    if val_range and value not in val_range:
+        raise AppotechError(
+            f"Cannot assign {var_name} to {value} because "
+            f"it's not in the accepted range: {val_range}"
+        )
+    return value
+
+
+def _convert_bytes(var_name, var_value, var_type, val_range, len_range):
+    # Allow slight variance in what HEX we can take as input
+    var_value = var_value.replace(":", "").replace(" ", "").lower()
+    try:
+        value = var_type.fromhex(var_value)
+    except ValueError as ex:
+        raise AppotechError(
+            f"Cannot assign {var_name} to \"{var_value}\" because "
+            f"it's not a valid HEX string"
+        ) from ex  # fmt: skip
+    if len_range and len(value) not in len_range:
+        raise AppotechError(
+            f"Cannot assign {var_name} to {value} because "
+            f"it's not in the accepted range: {len_range}"
+        )
+    return value
+
+
+def _convert_str(var_name, var_value, var_type, val_range, len_range):
+    if len_range and len(var_value) not in len_range:
+        raise AppotechError(
+            f"Cannot assign {var_name} to \"{var_value}\" because "
+            f"it's not in the accepted range: {len_range}"
+        )  # fmt: skip
+    return var_value
+
+
+def _convert_bool(var_name, var_value, var_type, val_range, len_range):
+    lowered: str = var_value.lower()
+    if lowered in ("1", "true"):
+        return True
+    if lowered in ("0", "false"):
+        return False
+    raise AppotechError(
+        f"Cannot assign {var_name} to \"{var_value}\" because "
+        f"only (1, true, 0, false) are supported for booleans"
+    )  # fmt: skip
+
+
+# Converters from `str` for each of the supported field types
+_CONVERTERS = {
+    int: _convert_int,
+    bytes: _convert_bytes,
+    bytearray: _convert_bytes,
+    str: _convert_str,
+    bool: _convert_bool,
+}
+
+
+def convert_value(
     obj,
     var_name: str,
     var_value: str,
@@ -97,57 +204,62 @@ def set_variable(
     len_range: range = None,
 ):
     """Convert the value type from `str` to a necessary one using type hints,
-    then check if the value meets specific criteria and apply it."""
-    type_hints = get_type_hints(obj)
-    var_type: type = type_hints.get(var_name)
-
-    if var_type == int:
-        value: int = int(var_value)
-        if val_range and value not in val_range:
-            raise AppotechError(
-                f"Cannot assign {var_name} to {value} because "
-                f"it's not in the accepted range: {val_range}"
-            )
-        setattr(obj, var_name, value)
-    elif var_type == bytes or var_type == bytearray:
-        # Allow slight variance in what HEX we can take as input
-        var_value = var_value.replace(":", "").replace(" ", "").lower()
-        value = (bytes if var_type == bytes else bytearray).fromhex(var_value)
-        if len_range and len(value) not in len_range:
-            raise AppotechError(
-                f"Cannot assign {var_name} to {value} because "
-                f"it's not in the accepted range: {len_range}"
-            )
-        setattr(obj, var_name, value)
-    elif var_type == str:
-        if len_range and len(var_value) not in len_range:
-            raise AppotechError(
-                f"Cannot assign {var_name} to \"{value}\" because "
-                f"it's not in the accepted range: {len_range}"
-            )  # fmt: skip
-        setattr(obj, var_name, var_value)
-    elif var_type == bool:
-        var_value = var_value.lower()
-        if var_value in ("1", "true"):
-            setattr(obj, var_name, True)
-        elif var_value in ("0", "false"):
-            setattr(obj, var_name, False)
-        else:
-            raise AppotechError(
-                f"Cannot assign {var_name} to \"{value}\" because "
-                f"only (1, true, 0, false) are supported for booleans"
-            )  # fmt: skip
-    else:
+    then check if the value meets specific criteria and return it."""
+    var_type: type = _type_hints(type(obj)).get(var_name)
+    convert = _CONVERTERS.get(var_type)
+    if convert is None:
         raise AppotechError(f"Unknown object type: {var_type}, cannot proceed")
+    return convert(var_name, var_value, var_type, val_range, len_range)
+
+
+def set_variable(
+    obj,
+    var_name: str,
+    var_value: str,
+    val_range: range = None,
+    len_range: range = None,
+):
+    """Convert the value with `convert_value` and apply it."""
+    value = convert_value(obj, var_name, var_value, val_range, len_range)
+    setattr(obj, var_name, value)
+
+
+def map_file(path: str) -> Union[bytes, mmap.mmap]:
+    """Map the file at `path` into memory for reading without copying it.
+    An empty file can't be mapped, so empty `bytes` are returned instead."""
+    with open(path, "rb") as fis:
+        if os.fstat(fis.fileno()).st_size == 0:
+            return b""
+        # The mapping stays valid after the file object is closed
+        return mmap.mmap(fis.fileno(), 0, access=mmap.ACCESS_READ)
 
 
-def write_and_check(path: str, data: bytes) -> bool:
-    """Write `data` to `file` and check if everything has been written.
+def write_and_check(path: str, *chunks: bytes) -> bool:
+    """Write `chunks` one after another to `file` and check if everything has
+    been written. Any bytes-like objects are accepted, so unchanged parts of a
+    big file can be passed as views instead of being copied into one blob.
     Return true if all bytes have been written successfully."""
     bytes_written: int = 0
-    bytes_expected: int = len(data)
-    with open(path, "wb") as fos:
-        bytes_written: int = fos.write(data)
+    bytes_expected: int = sum(len(chunk) for chunk in chunks)
+    # Don't truncate the file before writing: the chunks may be views of this
+    # very file mapped into memory. Cut off the leftovers afterwards instead.
+    # The chunks are written with plain `os.write` calls, going through a
+    # buffered file object would only copy big chunks once more.
+    fd: int = os.open(path, os.O_WRONLY | os.O_CREAT, 0o666)
+    try:
+        for chunk in chunks:
+            view: memoryview = memoryview(chunk).cast("B")
+            while view:
+                written: int = os.write(fd, view[:_WRITE_MAX])
+                if not written:
+                    break
+                bytes_written += written
+                view = view[written:]
+        # Only a regular file can have leftovers, and only it can be cut
+        if stat.S_ISREG(os.fstat(fd).st_mode):
+            os.ftruncate(fd, bytes_written)
+    finally:
+        os.close(fd)
     if bytes_written == bytes_expected:
         logging.info(f"Wrote {bytes_written} bytes to {path}")
     else:
@@ -17,21 +17,33 @@ class BtInfo:
     """
 
     _FMT: str = "<xBBBB4x32s6s10xH"
+    _STRUCT: struct.Struct = struct.Struct(_FMT)
+    _STRUCT_NO_CHECKSUM: struct.Struct = struct.Struct(_FMT[:-1])
     MAGIC: bytes = b"BTINF"
-    SIZE = len(MAGIC) + struct.calcsize(_FMT)
+    SIZE = len(MAGIC) + _STRUCT.size
     logger: logging.Logger = logging.getLogger(__name__)
 
     FLAG_CUST_BT_NAME = bit(0)
     FLAG_CUST_BT_MAC = bit(1)
     FLAG_CUST_MUTE_CFG = bit(2)
 
-    flags: int = 0
-    mic_unmute_thresh: int = 0
-    mic_mute_thresh: int = 0
-    mic_mute_duration: int = 0
-    bt_name: str = ""
-    bt_mac: bytes = b""
-    checksum: int = 0
+    # The fields live in slots, their defaults are set in `__init__`
+    __slots__ = (
+        "flags",
+        "mic_unmute_thresh",
+        "mic_mute_thresh",
+        "mic_mute_duration",
+        "bt_name",
+        "bt_mac",
+        "checksum",
+    )
+    flags: int
+    mic_unmute_thresh: int
+    mic_mute_thresh: int
+    mic_mute_duration: int
+    bt_name: str
+    bt_mac: bytes
+    checksum: int
 
     CONFIGURABLES = (
         "flags",
@@ -68,8 +80,8 @@ class BtInfo:
         if len(data) < self.SIZE:
             raise AppotechTruncatedError(self.SIZE, len(data))
 
-        # Validate header
-        if not data.startswith(self.MAGIC):
+        # Validate header. Compare a slice to accept any bytes-like object.
+        if data[: len(self.MAGIC)] != self.MAGIC:
             raise AppotechError("Invalid magic")
         off += len(self.MAGIC)
 
@@ -82,12 +94,16 @@ class BtInfo:
                 self.bt_name,
                 self.bt_mac,
                 self.checksum,
-            ) = struct.unpack(self._FMT, data[off : self.SIZE])
-
-            # fixup the bluetooth name by converting it to string
-            self.bt_name = self.bt_name.split(b"\x00")[0].decode("utf-8")
+            ) = self._STRUCT.unpack_from(data, off)
+
+            # fixup the bluetooth name by converting it to string,
+            # it ends at the first NUL if there's one
+            nul: int = self.bt_name.find(b"\x00")
+            if nul != -1:
+                self.bt_name = self.bt_name[:nul]
+            self.bt_name = self.bt_name.decode("utf-8")
             # fixup bluetooth mac address endianness
-            self.bt_mac = bytes(reversed(self.bt_mac))
+            self.bt_mac = self.bt_mac[::-1]
         except (UnicodeDecodeError, struct.error) as ex:
             raise AppotechError(
                 f"Could not load entry from {data.hex()}"
@@ -103,18 +119,19 @@ class BtInfo:
             )
 
     def __bytes__(self) -> bytes:  # noqa: D105
-        data_without_checksum: bytes = self.MAGIC + struct.pack(
-            self._FMT[:-1],
-            self.flags,
-            self.mic_unmute_thresh,
-            self.mic_mute_thresh,
-            self.mic_mute_duration,
-            self.bt_name.encode(),
-            bytes(reversed(self.bt_mac)),
+        data_without_checksum: bytes = self.MAGIC + (
+            self._STRUCT_NO_CHECKSUM.pack(
+                self.flags,
+                self.mic_unmute_thresh,
+                self.mic_mute_thresh,
+                self.mic_mute_duration,
+                self.bt_name.encode(),
+                self.bt_mac[::-1],
+            )
         )
         # Don't be afraid of `checksum` overflow, its max value is 65536 (0xFFFF)
         # The structure is 62 bytes long, max possible sum is 0xFF * 62 = 15872 (0x3E00)
-        checksum: bytes = struct.pack("<H", sum(data_without_checksum))
+        checksum: bytes = sum(data_without_checksum).to_bytes(2, "little")
         return data_without_checksum + checksum
 
     def __str__(self) -> str:  # noqa: D105
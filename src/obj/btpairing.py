@@ -3,7 +3,7 @@
 
 import logging
 import struct
-from typing import List
+from typing import List, Optional
 from src.common import as_hex
 from src.error import AppotechError, AppotechTruncatedError
 
@@ -26,8 +26,8 @@ class BtPairing:
 
     CONFIGURABLES = tuple("paired_idx")
 
-    def __init__(self, entries=[], paired_idx=0):
-        self.entries = entries
+    def __init__(self, entries=None, paired_idx=0):
+        self.entries = [] if entries is None else entries
         self.paired_idx = paired_idx
 
         # Initialize with an empty entry by default
@@ -45,32 +45,41 @@ class BtPairing:
         if len(data) < size_check:
             raise AppotechTruncatedError(size_check, len(data))
 
-        # Validate header
-        if not data.startswith(self.MAGIC):
+        # Validate header. Compare a slice to accept any bytes-like object.
+        if data[: len(self.MAGIC)] != self.MAGIC:
             raise AppotechError("Invalid magic")
         off += len(self.MAGIC)
 
-        # Read entries one by one
-        while True:
+        # Find out how many entries to read before decoding any of them.
+        # Take the `is_valid` field (the last byte) of every entry that fits
+        # in the data source with a single strided slice, the entries are
+        # valid up to the first value other than 1.
+        entry_size: int = BtPairing.Entry.SIZE
+        n_max: int = (len(data) - off) // entry_size
+        is_valid_col: bytes = bytes(
+            data[off + entry_size - 1 : off + n_max * entry_size : entry_size]
+        )
+        n_valid: int = n_max - len(is_valid_col.lstrip(b"\x01"))
+        if n_valid < n_max:
+            # Stop on first invalid entry
+            self.logger.warning("Stop reading: abnormal `is_valid` value")
+        else:
             # Stop if we exhausted the data source
-            size_check = len(data) - off
-            if size_check < BtPairing.Entry.SIZE:
-                self.logger.warning(
-                    f"Stop reading: expected {BtPairing.Entry.SIZE} bytes, "
-                    f"{size_check} available"
-                )
-                break
-            # Stop on first invalid entry. Prematurely parse the `is_valid`
-            # field of the struct and check its value.
-            entry_data: bytes = data[off : off + BtPairing.Entry.SIZE]
-            if entry_data[-1] != 1:
-                self.logger.warning("Stop reading: abnormal `is_valid` value")
-                break
-
-            entry = BtPairing.Entry()
-            entry.load(entry_data)
-            self.entries.append(entry)
-            off += BtPairing.Entry.SIZE
+            size_check = len(data) - off - n_max * entry_size
+            self.logger.warning(
+                f"Stop reading: expected {entry_size} bytes, "
+                f"{size_check} available"
+            )
+
+        # Read entries one by one, in place. All of them fit in `data`.
+        # Look up the class and the bound method just once for the loop.
+        entry_cls = BtPairing.Entry
+        append = self.entries.append
+        for _ in range(n_valid):
+            entry = entry_cls()
+            entry.load_from(data, off)
+            append(entry)
+            off += entry_size
 
         if not self.entries:
             raise AppotechError("No entries were read")
@@ -87,12 +96,15 @@ class BtPairing:
         return len(self.MAGIC) + len(self.entries) * BtPairing.Entry.SIZE + 1
 
     def __bytes__(self) -> bytes:  # noqa: D105
-        data = (
-            self.MAGIC
-            + b"".join([bytes(e) for e in self.entries])
-            + struct.pack("<B", self.paired_idx)
-        )
-        return data
+        # Pack everything into one preallocated buffer
+        data: bytearray = bytearray(self.length())
+        off: int = len(self.MAGIC)
+        data[:off] = self.MAGIC
+        for entry in self.entries:
+            entry.pack_into(data, off)
+            off += BtPairing.Entry.SIZE
+        data[off] = self.paired_idx
+        return bytes(data)
 
     def __repl__(self):  # noqa: D105
         return f"BtPairing({self.entries.__repr__()}, {self.paired_idx})"
@@ -120,12 +132,15 @@ class BtPairing:
         """
 
         _FMT: str = "<16s6s32sB"
-        SIZE: int = struct.calcsize(_FMT)
+        _STRUCT: struct.Struct = struct.Struct(_FMT)
+        SIZE: int = _STRUCT.size
 
         link_key: bytes
         bt_mac: bytes
-        bt_name: str
+        bt_name: str  # a property, see below
         is_valid: bool
+        _bt_name: Optional[str]  # None until decoded from `_bt_name_enc`
+        _bt_name_enc: bytes  # `bt_name` encoded, ready to be packed
 
         CONFIGURABLES = ("link_key", "bt_mac", "bt_name", "is_valid")
 
@@ -151,33 +166,68 @@ class BtPairing:
             # Validate size
             if len(data) < self.SIZE:
                 raise AppotechTruncatedError(self.SIZE, len(data))
+            self.load_from(data, 0)
 
+        def load_from(self, buf, off: int):
+            """Decode the entry found at `off` in `buf` without slicing it out.
+            The caller must check that it fits."""
             try:
                 (
                     self.link_key,
                     self.bt_mac,
-                    self.bt_name,
+                    name,
                     u8_is_valid,
-                ) = struct.unpack(self._FMT, data)
+                ) = self._STRUCT.unpack_from(buf, off)
 
                 # fixup bluetooth mac address endianness
-                self.bt_mac = bytes(reversed(self.bt_mac))
-                # fixup the bluetooth name by converting it to string
-                self.bt_name = self.bt_name.split(b"\x00")[0].decode("utf-8")
+                self.bt_mac = self.bt_mac[::-1]
+                # fixup the bluetooth name, it ends at the first NUL if
+                # there's one. The raw bytes are what `bt_name` encodes to.
+                nul: int = name.find(b"\x00")
+                if nul != -1:
+                    name = name[:nul]
+                self._bt_name_enc = name
+                # An ASCII name always decodes, leave converting it to string
+                # until it's read. Decode anything else right away to reject
+                # invalid UTF-8 while loading.
+                self._bt_name = None if name.isascii() else name.decode("utf-8")
                 # fixup the is_valid flag to be boolean
                 self.is_valid = u8_is_valid == 1
             except (UnicodeDecodeError, struct.error) as ex:
                 raise AppotechError(
-                    f"Could not load entry from {as_hex(data)}"
+                    "Could not load entry from "
+                    f"{as_hex(buf[off : off + self.SIZE])}"
                 ) from ex
 
+        @property
+        def bt_name(self) -> str:  # noqa: D102
+            if self._bt_name is None:
+                self._bt_name = self._bt_name_enc.decode("utf-8")
+            return self._bt_name
+
+        @bt_name.setter
+        def bt_name(self, value: str):
+            """Encode the name once when it's set, not on every packing."""
+            self._bt_name = value
+            self._bt_name_enc = value.encode()
+
         def __bytes__(self) -> bytes:  # noqa: D105
             """MAC will be in its original form"""
-            return struct.pack(
-                self._FMT,
+            return self._STRUCT.pack(
+                self.link_key,
+                self.bt_mac[::-1],
+                self._bt_name_enc,
+                int(self.is_valid),
+            )
+
+        def pack_into(self, buf: bytearray, off: int):
+            """Pack the entry into `buf` at `off`, like `__bytes__` does."""
+            self._STRUCT.pack_into(
+                buf,
+                off,
                 self.link_key,
-                bytes(reversed(self.bt_mac)),
-                self.bt_name.encode(),
+                self.bt_mac[::-1],
+                self._bt_name_enc,
                 int(self.is_valid),
             )
 
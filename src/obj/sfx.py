@@ -6,17 +6,21 @@ import struct
 import wave
 from abc import ABC, abstractmethod
 from io import BytesIO
-from typing import List, Tuple
+from typing import List, Union
 
 from src.common import align_bytes
 from src.error import AppotechTruncatedError
 
+# Lookup table to flip the sign bit of every 8-bit WAV sample at once
+_WAV8_XOR_TABLE = bytes(i ^ 0x80 for i in range(256))
+
 
 class AbstractSfxEntry(ABC):
     """An abstract SFX entry. Make a descender class for each audio format."""
 
     _FMT: str = "<IHH"
-    SIZE: int = struct.calcsize(_FMT)
+    _STRUCT: struct.Struct = struct.Struct(_FMT)
+    SIZE: int = _STRUCT.size
 
     CHUNK_SIZE = 0x100
 
@@ -27,8 +31,9 @@ class AbstractSfxEntry(ABC):
     size: int
     """Sampling rate of an SFX."""
     samplerate: int
-    """Raw audio data."""
-    contents: bytes
+    """Raw audio data. An entry loaded from an SFX blob may keep a read-only
+    view of the blob here instead of a copy, see `import_from_blob`."""
+    contents: Union[bytes, memoryview]
 
     def __init__(
         self,
@@ -52,31 +57,35 @@ class AbstractSfxEntry(ABC):
         """Calculate the total size of the SFX in bytes."""
         pass
 
-    @abstractmethod
-    def export_to_blob(self) -> Tuple[bytes, bytes]:
-        """Generate the byte representation of the entry for inclusion into the
-        new SFX blob.
+    def write_into(self, buf: bytearray, hdr_off: int):
+        """Write the entry into the new SFX blob being built in place.
 
-        Returns:
-            Tuple[bytes, bytes]: (header), (audio data).
+        Parameters:
+            buf (bytearray): SFX blob buffer, big enough to fit the entry.
+            hdr_off (int): Offset of the entry's record in the blob header.
         """
-        pass
+        self._STRUCT.pack_into(
+            buf, hdr_off, self.offset, self.size, self.samplerate
+        )
+        buf[self.offset : self.offset + len(self.contents)] = self.contents
 
     @abstractmethod
-    def export_to_file(self) -> bytes:
+    def export_to_file(self) -> Union[bytes, memoryview]:
         """Generate bytes for export to an external standalone audio file.
 
         Returns:
-            bytes: audio file data.
+            Union[bytes, memoryview]: audio file data, possibly a view.
         """
         pass
 
     @abstractmethod
-    def import_from_blob(self, data: bytes):
+    def import_from_blob(self, data: memoryview):
         """Load entry contents from the SFX blob.
 
         Parameters:
-            data (bytes): Raw SFX blob data.
+            data (memoryview): Raw SFX blob data. The entry may keep the view
+                as its `contents` (it's valid as long as the blob source is),
+                or copy whatever it needs into `bytes`.
         """
         pass
 
@@ -92,10 +101,7 @@ class AbstractSfxEntry(ABC):
 
     def __bytes__(self) -> bytes:
         """Export offset, size and samplerate as `bytes`."""
-        data: bytes = struct.pack(
-            self._FMT, self.offset, self.size, self.samplerate
-        )
-        return data
+        return self._STRUCT.pack(self.offset, self.size, self.samplerate)
 
     @abstractmethod
     def __str__(self) -> str:
@@ -110,14 +116,13 @@ class Mp3SfxEntry(AbstractSfxEntry):  # noqa: D101
     def total_size_in_bytes(self) -> int:
         return self.size * self.CHUNK_SIZE
 
-    def export_to_blob(self) -> Tuple[bytes, bytes]:
-        return self.__bytes__(), self.contents
-
-    def export_to_file(self) -> bytes:
+    def export_to_file(self) -> Union[bytes, memoryview]:
         return self.contents
 
-    def import_from_blob(self, data: bytes):
-        self.contents = data  # import as is
+    def import_from_blob(self, data: memoryview):
+        # Import as is. The contents are only ever written out unchanged, so
+        # keep the view of the blob instead of copying it.
+        self.contents = data
 
     def import_from_file(self, offset: int, data: bytes):
         self.offset = offset
@@ -140,6 +145,7 @@ class WavSfxEntry(AbstractSfxEntry):  # noqa: D101
     WAV_TRAILER_SIZE: int = 0x100
     TRAILER_MAGIC: bytes = b"WAV\x00"
     _TRAILER_FMT: str = "<4sBB250x"
+    _TRAILER_STRUCT: struct.Struct = struct.Struct(_TRAILER_FMT)
 
     trailer: bytes = b""
     tr_samplerate: int = 0  # kHz
@@ -156,23 +162,30 @@ class WavSfxEntry(AbstractSfxEntry):  # noqa: D101
     def total_size_in_bytes(self) -> int:
         return self.size * self.CHUNK_SIZE + self.WAV_TRAILER_SIZE
 
-    def export_to_blob(self) -> Tuple[bytes, bytes]:
-        return self.__bytes__(), self.contents + self.trailer
+    def write_into(self, buf: bytearray, hdr_off: int):
+        super().write_into(buf, hdr_off)
+        # The trailer follows the audio data
+        trailer_off: int = self.offset + len(self.contents)
+        buf[trailer_off : trailer_off + len(self.trailer)] = self.trailer
 
     def export_to_file(self) -> bytes:
         """Attempt to reconstruct the WAV header."""
-        # Also reverse the WAV 0x80 thingy.
-        xor: int = 0x80 if self.tr_resolution == 8 else 0x00
         baos: BytesIO = BytesIO()
         with wave.open(baos, "wb") as wav:
             wav.setnchannels(1)  # always mono
             wav.setsampwidth(self.tr_resolution // 8)  # bits to bytes
             wav.setframerate(self.tr_samplerate * 1000)  # kHz to Hz
-            wav.writeframesraw(bytes([b ^ xor for b in self.contents]))
+            # Also reverse the WAV 0x80 thingy. Only 8-bit samples are XORed,
+            # pass anything else through as is.
+            frames: bytes = self.contents
+            if self.tr_resolution == 8:
+                frames = frames.translate(_WAV8_XOR_TABLE)
+            wav.writeframesraw(frames)
         return baos.getvalue()
 
-    def import_from_blob(self, data: bytes):
-        self.contents = data
+    def import_from_blob(self, data: memoryview):
+        # The trailer is parsed and cut off, work on a copy
+        self.contents = bytes(data)
 
         # Check if there's trailer magic in the last 0x100 bytes of `contents`
         wav_test: bytes = self.contents[-self.WAV_TRAILER_SIZE :][:4]
@@ -186,8 +199,8 @@ class WavSfxEntry(AbstractSfxEntry):  # noqa: D101
             raise AppotechTruncatedError(
                 self.WAV_TRAILER_SIZE, len(self.trailer)
             )
-        _, self.tr_samplerate, self.tr_resolution = struct.unpack(
-            self._TRAILER_FMT, self.trailer
+        _, self.tr_samplerate, self.tr_resolution = (
+            self._TRAILER_STRUCT.unpack(self.trailer)
         )
 
         # Keep the raw audio data without the WAV trailer
@@ -195,23 +208,26 @@ class WavSfxEntry(AbstractSfxEntry):  # noqa: D101
 
     def import_from_file(self, offset: int, data: bytes):
         self.offset = offset
-        xor: int = 0x00
         bais: BytesIO = BytesIO(data)
+        frames: bytes
         with wave.open(bais, "rb") as wav:
+            # Get all the parameters at once, then read the raw frame data
+            params = wav.getparams()
+            frames = wav.readframes(params.nframes)
+
             # be very forgiving to allow experimenting, but it will backfire
-            if wav.getnchannels() != 1:
+            if params.nchannels != 1:
                 logging.warning("Only mono WAV is supported!")
 
-            self.tr_resolution = wav.getsampwidth() * 8  # bytes to bits
+            self.tr_resolution = params.sampwidth * 8  # bytes to bits
             if self.tr_resolution not in (8, 16):
                 logging.warning(f"{self.tr_resolution}-bit WAV isn't supported")
             elif self.tr_resolution == 16:
                 logging.warning(
                     "16-bit WAV might be not supported if your firmware is old"
                 )
-            xor = 0x80 if self.tr_resolution == 8 else 0x00
 
-            self.samplerate = wav.getframerate()
+            self.samplerate = params.framerate
             self.tr_samplerate = self.samplerate // 1000  # Hz to kHz
             if self.tr_samplerate not in (8, 16, 32):
                 logging.warning("Only 8/16/32 kHz samplerate is supported")
@@ -221,17 +237,15 @@ class WavSfxEntry(AbstractSfxEntry):  # noqa: D101
                     "firmware is old"
                 )
         # Assemble the WAV trailer now. Not very memory-efficient, though...
-        self.trailer = struct.pack(
-            self._TRAILER_FMT,
+        self.trailer = self._TRAILER_STRUCT.pack(
             self.TRAILER_MAGIC,
             self.tr_samplerate,
             self.tr_resolution,
         )
-        # Read raw frame data and pad it with zeroes
-        self.contents = align_bytes(
-            bytes([b ^ xor for b in wav.readframes(wav.getnframes())]),
-            self.CHUNK_SIZE,
-        )
+        # Pad the raw frame data with zeroes
+        if self.tr_resolution == 8:
+            frames = frames.translate(_WAV8_XOR_TABLE)
+        self.contents = align_bytes(frames, self.CHUNK_SIZE)
         # Adjust size
         self.size = len(self.contents) // self.CHUNK_SIZE
 
@@ -257,12 +271,14 @@ class SfxBlob:
 
     entries: List[AbstractSfxEntry]
 
-    def __init__(self, entries=[]):
-        self.entries = entries
+    def __init__(self, entries=None):
+        self.entries = [] if entries is None else entries
 
     def load(self, data: bytes):
         """Load structure from an existing SFX blob from firmware."""
         self.entries.clear()
+        # Entry contents are handed out as views, see `import_from_blob`
+        data = memoryview(data)
 
         # Validate size. Can't check entries yet, check the header for now
         size_check: int = self.HDR_SIZE
@@ -271,11 +287,11 @@ class SfxBlob:
 
         # Load available entries from header
         self.logger.info("Reading header")
-        for off in range(0, self.HDR_SIZE, AbstractSfxEntry.SIZE):
-            e_offset, e_size, e_samplerate = struct.unpack(
-                AbstractSfxEntry._FMT, data[off : off + AbstractSfxEntry.SIZE]
-            )
-            if not any((e_offset, e_size, e_samplerate)):
+        # Unpack the records one after another in a single C-level iteration
+        records = AbstractSfxEntry._STRUCT.iter_unpack(data[: self.HDR_SIZE])
+        append = self.entries.append  # looked up once for the loop
+        for e_offset, e_size, e_samplerate in records:
+            if not (e_offset or e_size or e_samplerate):
                 self.logger.warning("Stop reading: first empty entry found")
                 break
 
@@ -286,7 +302,7 @@ class SfxBlob:
                 entry = WavSfxEntry(e_offset, e_size, e_samplerate)
             else:
                 entry = Mp3SfxEntry(e_offset, e_size, e_samplerate)
-            self.entries.append(entry)
+            append(entry)
 
         # Load the contents of each entry
         self.logger.info("Reading contents of entries")
@@ -321,14 +337,18 @@ class SfxBlob:
             e.total_size_in_bytes() for e in self.entries
         )
 
-    def __bytes__(self) -> bytes:
+    def to_bytearray(self) -> bytearray:
+        """Build the SFX blob. Unlike `bytes()`, this returns the buffer it has
+        been built in, so big blobs aren't copied once more just to be
+        written to a file."""
         header_off: int = 0
         result: bytearray = bytearray(self.total_size_in_bytes())
 
         for entry in self.entries:
-            e_hdr, e_body = entry.export_to_blob()
-            result[header_off : header_off + len(e_hdr)] = e_hdr
-            result[entry.offset : entry.offset + len(e_body)] = e_body
-            header_off += len(e_hdr)
+            entry.write_into(result, header_off)
+            header_off += AbstractSfxEntry.SIZE
 
-        return bytes(result)
+        return result
+
+    def __bytes__(self) -> bytes:
+        return bytes(self.to_bytearray())